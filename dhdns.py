@@ -39,21 +39,84 @@ import requests
 import http_access
 import interfaces
 
+def previous_snapshot(previous_addresses):
+    """Build an address snapshot from the previous address file's lines.
+    The loopback placeholders written by older versions of the file just
+    mean "nothing published yet"."""
+    return frozenset(
+        address for address in map(ipaddress.ip_address, previous_addresses)
+        if not address.is_loopback)
+
+def create_accessor(api_url):
+    """Set up the http_accessor object"""
+    try:
+        return http_access.http_access(api_url)
+    except KeyError as error:
+        logging.critical("Could not set up DreamHost API communications. Error:  %s" % (error))
+        sys.exit()
+
+def remove_record(dreamhost_accessor, api_key, entry):
+    """Remove old DNS records from DreamHost.  There is no option to modify
+    existing records; they must be deleted and then re-added."""
+    # We update the record by removing the old record, and adding a new one.
+    # DreamHost only allows `record`, `type`. and `value` for DNS
+    # record deletion; so we will create a new dict with those values.
+    # Start by building request parameters for the request library
+    request_params={key: entry[key] for key in ("record", "type", "value")}
+    # Add things we need - api.key, cmd, format...
+    request_params["key"] = api_key
+    request_params["cmd"] = "dns-remove_record"
+    request_params["format"] = "json"
+
+    # And now remove the old/nonmatching values from DreamHost
+    logging.info("Removing DNS entry with parameters: %s" %(request_params))
+    output = dreamhost_accessor.request_get(request_params)
+    if output["result"] != "success":
+        logging.error("Could not remove entry for address %s" % (request_params["value"]))
+
+def add_record(dreamhost_accessor, api_key, hostname, address):
+    """Add new records to DreamHost.  There is no option to modify
+    existing records; they must be deleted and then re-added."""
+    # Create the requst parameters to add for the entry & record type
+    # Add has four fields:  record, type, value comment
+    
+    # First, we create the request parameters for the request library
+    request_params={}
+    request_params["key"] = api_key
+    request_params["cmd"] = "dns-add_record"
+    request_params["record"] = hostname
+    request_params["comment"] = "Automated DNS update by dhdynupdate"
+    request_params["format"] = "json"
+    request_params["value"] = address.compressed
+    if address.version == 4:
+        request_params["type"] = "A"
+    elif address.version == 6:
+        request_params["type"] = "AAAA"
+    else:
+        logging.critical("Invalid address type %s ! Exiting!" % (address))
+        sys.exit(7)
+
+    #And now that we have the parameters, we update DreamHost:
+    logging.info("Adding DNS entry with parameters: %s" %(request_params))
+    output = dreamhost_accessor.request_get(request_params)
+    if output["result"] != "success":
+        logging.error("Could not update entry for address %s" % (address))
+
 class dhdns():
     api_key = ""
     local_hostname = ""
 
-    def __init__(self, api_key, api_url, local_hostname, configured_interfaces, bExternal, external_url, previous_v4_address, previous_v6_address):
+    def __init__(self, api_key, api_url, local_hostname, configured_interfaces, bExternal, external_url, previous_addresses, include_deprecated=False, include_temporary=False):
         """Initialize dnsupdate"""
         # Pull configuration from config_settings
         self.api_key = api_key
         self.local_hostname = local_hostname
         self.configured_interfaces = configured_interfaces
         self.use_external = bExternal
-        self.interface = interfaces.interfaces(self.configured_interfaces)
-        self.previous_v4_address = ipaddress.ip_address(previous_v4_address)
-        self.previous_v6_address = ipaddress.ip_address(previous_v6_address)
-        self.prev_addresses = [ self.previous_v4_address, self.previous_v6_address ]
+        self.interface = interfaces.interfaces(self.configured_interfaces,
+                                               include_deprecated,
+                                               include_temporary)
+        self.prev_addresses = previous_snapshot(previous_addresses)
         
         if self.use_external:
             if logging.getLogger().getEffectiveLevel() == logging.INFO:
@@ -79,11 +142,7 @@ class dhdns():
                 logging.getLogger("requests").setLevel(logging.getLogger().getEffectiveLevel())
             
         # Set up http_accessor object.
-        try:
-            self.dreamhost_accessor = http_access.http_access(api_url)
-        except KeyError as error:
-            logging.critical("Could not set up DreamHost API communications. Error:  %s" % (error))
-            sys.exit()
+        self.dreamhost_accessor = create_accessor(api_url)
 
     def update_if_necessary(self):
         """Main dæmon loop - watches for changes to IP addresses on the host
@@ -91,64 +150,47 @@ class dhdns():
         triggered."""
         # We really only want to update_addresses() if one or more of our
         # IP addresses have changed.
-        update_ipv6 = False
-        update_ipv4 = False
-        new_v4_address = self.previous_v4_address
-        new_v6_address = self.previous_v6_address
-        
-        if not self.interface.addresses:
+        current_addresses = self.interface.get_if_addresses(self.configured_interfaces)
+
+        if self.use_external:
+            # Replace all local IPv4 addresses with the external IP; with
+            # no local IPv4 address, there's nothing to replace.
+            local_v4 = [naddress for naddress in current_addresses if naddress.version == 4]
+            for naddress in local_v4:
+                logging.info("Overriding internal address with external address:  %s => %s" % (naddress, self.external_ip))
+            if local_v4:
+                current_addresses = frozenset(
+                    [naddress for naddress in current_addresses if naddress.version != 4]
+                    + [self.external_ip])
+
+        if not current_addresses:
             logging.critical("Self.interface.addresses is empty!")
             sys.exit(8)
         else:
-            logging.debug("Self.interface is:  %s" % (self.interface.addresses))
-        
-        self.interface.addresses = self.interface.get_if_addresses(self.configured_interfaces)
-        
-        if self.use_external:
-            #set all local address to the external IP
-            for i, naddress in enumerate(self.interface.addresses):
-                if naddress.version == 4:
-                    logging.info("Overriding internal address with external address:  %s => %s" % (naddress, self.external_ip))
-                    self.interface.addresses[i] = self.external_ip
-                
-        for naddress in self.interface.addresses:
-            logging.debug("Current address:  %s" % (naddress))
-            if naddress.version == 4:
-                if not self.previous_v4_address == naddress:
-                    update_ipv4 = True
-                    new_v4_address = naddress
-                    
-            elif naddress.version == 6:
-                if not self.previous_v6_address == naddress:
-                    update_ipv6 = True
-                    new_v6_address = naddress
-            
-            else:
-                logging.warn("Error in address version retrieved:  %s" % (naddress.version))
-                    
+            logging.debug("Current addresses:  %s" % (sorted(map(str, current_addresses))))
+
+        self.interface.addresses = current_addresses
+        added, removed = interfaces.diff_snapshots(self.prev_addresses, current_addresses)
+
         # If we have detected a changed IP address, update_addresses(), and
         # update the prev_addresses
-        if update_ipv6 or update_ipv4:
-            logging.debug("Updating prev addresses: %s/v4, %s/v6" % (self.previous_v4_address, self.previous_v6_address))
-            self.prev_addresses = [ self.previous_v4_address, self.previous_v6_address ]
-            
+        if added or removed:
             logging.info("Address change detected; updating DreamHost")
-            
-            if not self.previous_v4_address == new_v4_address:
-                logging.info("ipv4: New %s ... Old %s" % (new_v4_address, self.previous_v4_address))
-                self.previous_v4_address = new_v4_address
-            
-            if not self.previous_v6_address == new_v6_address:
-                logging.info("ipv6: New %s ... Old %s" % (new_v6_address, self.previous_v6_address))
-                self.previous_v6_address = new_v6_address
-                
+            for naddress in sorted(added, key=str):
+                logging.info("ipv%s: New %s" % (naddress.version, naddress))
+            for naddress in sorted(removed, key=str):
+                logging.info("ipv%s: Old %s" % (naddress.version, naddress))
+
             self.update_addresses()
-        
+            self.prev_addresses = current_addresses
+
         else:
             logging.info("no address change detected")
-            
+
     def get_dh_dns_records(self):
-        """Get the current DreamHost DNS records"""
+        """Get the current DreamHost DNS records.  Returns the editable
+        A/AAAA records for our configured hostname, and the set of address
+        versions (4/6) which have a read-only record we must not touch."""
         # Start by setting up a bit of data for the requests library.
         request_params = {"key":self.api_key, "cmd":"dns-list_records", "format":"json"}
         logging.info("Connecting to DreamHost API to obtain current DNS records")
@@ -157,120 +199,69 @@ class dhdns():
 
         # Get the current DNS records for our configured hostname
         target_records=[]
+        readonly_versions = set()
         for entry in dns_records:
+            # Verify if our entry has the hostname we're looking for.
+            # Multiple entries may, if we're using native dual-stack IPv4 &
+            # IPv6, or the host has several addresses per family.
+            if entry.get("record") != self.local_hostname:
+                continue
+            if entry.get("type") not in ("A", "AAAA"):
+                continue
             # Only operate on editable entries...
             if entry["editable"] == "1":
-                if "record" in entry:
-                    # Verify if our entry has the hostname we're looking for.
-                    # Multiple entries may, if we're using native dual-stack IPv4 &
-                    # IPv6.
-                    if entry["record"] == self.local_hostname:
-                        logging.debug("Editable value:  %s" % entry)
-                        target_records.append(entry)
+                logging.debug("Editable value:  %s" % entry)
+                target_records.append(entry)
             else: # read-only entry
                 logging.debug("Non-editable value:  %s" % entry)
-                if "record" in entry:
-                    if entry["record"] == self.local_hostname:
-                        # prevent a read-only record from being "added"
-                        dh_addr = ipaddress.ip_address(entry["value"])
-                        readonly_index = []
-                        for addr in self.interface.addresses:
-                            if addr.version == dh_addr.version:
-                                logging.info("Not operating on %s, as it's read-only" % (entry["record"]))
-                                readonly_index.append(self.interface.addresses.index(addr))
-                        for index in readonly_index:
-                            del self.interface.addresses[index]
-        return target_records
+                # prevent a read-only record from being "added"
+                dh_addr = ipaddress.ip_address(entry["value"])
+                logging.info("Not operating on ipv%s for %s, as it's read-only"
+                             % (dh_addr.version, entry["record"]))
+                readonly_versions.add(dh_addr.version)
+        return target_records, readonly_versions
 
-    def remove_old_records(self, entry, matching_index):
-        """Determine if the IP address at DreamHost is out of date vs the ip
-        addresses determined by get_if_address(). If a local IP address isn't
-        found for an interface, than the corresponding entry in DNS will be
-        removed"""
-        dh_addr = ipaddress.ip_address(entry["value"])
-        for addr in self.interface.addresses:
-            logging.debug(entry)
-            logging.debug("dh_addr: %s - %s" % (dh_addr, dh_addr.version))
-            logging.debug("addr: %s - %s" % (addr, addr.version))
-            if addr.version == dh_addr.version:
-                if addr == dh_addr:
-                    logging.info("DreamHost DNS entry matches our address:  %s"
-                                 % (addr))
-                    matching_index.append(self.interface.addresses.index(addr))
-                else:
-                    logging.info("DreamHost DNS entry %s does not match our address:  %s"
-                                 % (dh_addr, addr))
-                    self.remove_record(entry)
+    def update_addresses(self):
+        """Reconcile the DreamHost records for our hostname against the
+        current address snapshot; only the difference is sent to DreamHost"""
+        target_records, readonly_versions = self.get_dh_dns_records()
+        wanted = frozenset(address for address in self.interface.addresses
+                           if address.version not in readonly_versions)
+        # Only manage the address families we currently have addresses for;
+        # a family with no local address leaves DreamHost untouched.
+        managed_versions = set(address.version for address in wanted)
+
+        published = {}
+        for entry in target_records:
+            dh_addr = ipaddress.ip_address(entry["value"])
+            if dh_addr.version in managed_versions:
+                published[dh_addr] = entry
             else:
-                logging.debug("Address type (IPv4/IPv6) do not match")
-        return matching_index
+                logging.debug("Address type (IPv4/IPv6) not managed:  %s" % (dh_addr))
 
-    def update_addresses(self):
-        """Check if an address needs to be updated, and builds a list of
-           entries to send off to DreamHost"""
-        # matching_address_index is to store addresses which "match" on both sides
-        # -- and don't need updating.
-        matching_address_index= []
-        # Remove editable entries that don't exist/are changing
-        # They will be re-added (with new values) in a moment.
-        for entry in self.get_dh_dns_records():
-            matching_address_index = self.remove_old_records(entry, matching_address_index)
-        # Remove addresses which do not need updating; reverse order or else
-        # the indexes will be wrongthe next time around.
-        for index in sorted(matching_address_index, reverse=True):
-            del self.interface.addresses[index]
+        to_add, to_remove = interfaces.diff_snapshots(published, wanted)
+        for address in sorted(wanted - to_add, key=str):
+            logging.info("DreamHost DNS entry matches our address:  %s"
+                         % (address))
+
+        # Remove editable entries that no longer exist.  There is no
+        # modify, so a changed address is a remove plus an add.
+        for address in sorted(to_remove, key=str):
+            logging.info("DreamHost DNS entry %s is no longer one of our addresses"
+                         % (address))
+            self.remove_record(published[address])
 
-        # Add IP addresses detected from interfaces.
         # NOTE:  we can't do much about readonly entries that aren't listed
         # when we query DreamHost for DNS records. This means the shipping
         # configuration file will fail if you have an IPv6 address.
-        for address in self.interface.addresses:
+        for address in sorted(to_add, key=str):
             self.add_record(address)
 
     def remove_record(self, entry):
-        """Remove old DNS records from DreamHost.  There is no option to modify
-        existing records; they must be deleted and then re-added."""
-        # We update the record by removing the old record, and adding a new one.
-        # DreamHost only allows `record`, `type`. and `value` for DNS
-        # record deletion; so we will create a new dict with those values.
-        # Start by building request parameters for the request library
-        request_params={key: entry[key] for key in ("record", "type", "value")}
-        # Add things we need - api.key, cmd, format...
-        request_params["key"] = self.api_key
-        request_params["cmd"] = "dns-remove_record"
-        request_params["format"] = "json"
-
-        # And now remove the old/nonmatching values from DreamHost
-        logging.info("Removing DNS entry with parameters: %s" %(request_params))
-        output = self.dreamhost_accessor.request_get(request_params)
-        if output["result"] != "success":
-            logging.error("Could not remove entry for address %s" % (request_params["value"]))
+        """Remove an old DNS record for our hostname from DreamHost"""
+        remove_record(self.dreamhost_accessor, self.api_key, entry)
 
     def add_record(self, address):
-        """Add new records to DreamHost.  There is no option to modify
-        existing records; they must be deleted and then re-added."""
-        # Create the requst parameters to add for the entry & record type
-        # Add has four fields:  record, type, value comment
-        
-        # First, we create the request parameters for the request library
-        request_params={}
-        request_params["key"] = self.api_key
-        request_params["cmd"] = "dns-add_record"
-        request_params["record"] = self.local_hostname
-        request_params["comment"] = "Automated DNS update by dhdynupdate"
-        request_params["format"] = "json"
-        request_params["value"] = address.compressed
-        if address.version == 4:
-            request_params["type"] = "A"
-        elif address.version == 6:
-            request_params["type"] = "AAAA"
-        else:
-            logging.critical("Invalid address type %s ! Exiting!" % (address))
-            sys.exit(7)
-
-        #And now that we have the parameters, we update DreamHost:
-        logging.info("Adding DNS entry with parameters: %s" %(request_params))
-        output = self.dreamhost_accessor.request_get(request_params)
-        if output["result"] != "success":
-            logging.error("Could not update entry for address %s" % (address))
+        """Add a new DNS record for our hostname to DreamHost"""
+        add_record(self.dreamhost_accessor, self.api_key, self.local_hostname, address)
 # vim: ts=4 sw=4 et
@@ -41,6 +41,7 @@ import time
 import sys
 
 from dhdns import dhdns
+from prefix_fanout import prefix_fanout
 def setup_logger(logfile, log_level, append):
     """Does logging setup, using python logging"""
     sFileMode = 'w'
@@ -65,47 +66,49 @@ def setup_logger(logfile, log_level, append):
         logging.critical("Could not set up logging! Exiting!")
         sys.exit(2)
 
-previous_v4_address  = '127.0.0.1'
-previous_v6_address  = '::1'
+previous_addresses = []
+previous_prefixes = []
 def setup_prev_addr_file(logfile):
-    global previous_v4_address
-    global previous_v6_address
-    bWrite = False
+    """Load the previously published addresses, one per line.  Files written
+    by older versions (IPv4 on the first line, IPv6 on the second) load the
+    same way.  Lines holding a network are prefixes superseded by a prefix
+    delegation rotation."""
+    global previous_addresses
+    global previous_prefixes
     if os.path.isfile(logfile):
         with open(logfile, "r") as ins:
-            lines = []
             for line in ins:
-                lines.append(line)
-                
-        if len(lines) > 0:
-            if len(lines[0]) > 6:
-                previous_v4_address = lines[0].rstrip()
-                logging.info("Previous V4 address loaded from file: %s" % (previous_v4_address))
-            else:
-                bWrite = True
-        else:
-            bWrite = True
-        
-        if len(lines) > 1:
-            if len(lines[1]) > 3:
-                previous_v6_address = lines[1].rstrip()
-                logging.info("Previous V6 address loaded from file: %s" % (previous_v6_address))
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    if "/" in line:
+                        prefix = str(ipaddress.IPv6Network(line))
+                        previous_prefixes.append(prefix)
+                        logging.info("Superseded prefix loaded from file: %s" % (prefix))
+                        continue
+                    address = str(ipaddress.ip_address(line))
+                except ValueError:
+                    logging.warning("Ignoring invalid previous address: %s" % (line))
+                    continue
+                previous_addresses.append(address)
+                logging.info("Previous address loaded from file: %s" % (address))
     else:
-        bWrite = True
-        
-    if bWrite:
-        logging.debug("Writing new prev_addr_file: %s, %s" % (previous_v4_address, previous_v6_address))
-        try:
-            fo = open(logfile, "w")
-            fo.write(previous_v4_address + "\n")
-            fo.write(previous_v6_address + "\n")
-            fo.close()
-        except:
-            logging.critical("Could not write previous address file: %s" % (logfile))
-        
+        write_prev_addr_file(logfile, previous_addresses)
+
+def write_prev_addr_file(logfile, addresses):
+    logging.debug("Writing prev_addr_file: %s" % (", ".join(addresses)))
+    try:
+        fo = open(logfile, "w")
+        for address in addresses:
+            fo.write(address + "\n")
+        fo.close()
+    except:
+        logging.critical("Could not write previous address file: %s" % (logfile))
+
 def main(argv=None):
-    global previous_v4_address
-    global previous_v6_address
+    global previous_addresses
+    global previous_prefixes
     """Command line parser, begins DaemonContext for main loop"""
     if argv is None:
         argv = sys.argv
@@ -159,14 +162,32 @@ def main(argv=None):
     try:
         supported_address_families = ("AF_INET", "AF_INET6")
         configured_interfaces = {}
-        api_key = config[args.config_name]["api_key"]
         api_url = config["Global"]["api_url"]
         external_url = config["Global"]["external_url"]
-        local_hostname = config[args.config_name]["local_hostname"]
         logfile = config["Global"]["log_file"]
         prev_addr_file = config["Global"]["prev_addr_file"]
+        # A section listing prefix_hosts updates all of those hosts from
+        # one delegated IPv6 prefix; otherwise it's a single host.
+        prefix_hosts = None
+        if "prefix_hosts" in config[args.config_name]:
+            fanout_config = config[args.config_name]
+            prefix_hosts = []
+            for host_section in fanout_config["prefix_hosts"].split(","):
+                host_config = config[host_section.strip()]
+                prefix_hosts.append((host_config["api_key"],
+                                     host_config["local_hostname"],
+                                     host_config["interface_id"]))
+            prefix_interface = fanout_config.get("prefix_interface",
+                                                 config["Global"]["AF_INET6"])
+            prefix_length = int(fanout_config.get("prefix_length", "64"))
+            prev_addr_file = fanout_config.get("prev_addr_file", prev_addr_file)
+        else:
+            api_key = config[args.config_name]["api_key"]
+            local_hostname = config[args.config_name]["local_hostname"]
         update_interval = int(config["Global"]["update_interval"])
         pid_file = config["Global"]["pidfile"]
+        include_deprecated = config["Global"].getboolean("include_deprecated", fallback=False)
+        include_temporary = config["Global"].getboolean("include_temporary", fallback=False)
         for addr_type in supported_address_families:
             interface = config["Global"][addr_type]
             if interface in netifaces.interfaces():
@@ -183,9 +204,15 @@ def main(argv=None):
 #        logging.critical("Exception in parsing configuration settings: %s"
 #                         % (sys.exc_info()[0]))
         sys.exit(5)
-    
-    
-    
+    if prefix_hosts is not None and prefix_interface not in netifaces.interfaces():
+        print("Prefix interface %s not found" % (prefix_interface))
+        sys.exit(4)
+
+    def create_updater():
+        if prefix_hosts is not None:
+            return prefix_fanout(api_url, prefix_hosts, prefix_interface, prefix_length, previous_addresses, previous_prefixes, include_deprecated, include_temporary)
+        return dhdns(api_key, api_url, local_hostname, configured_interfaces, args.external_ip, external_url, previous_addresses, include_deprecated, include_temporary)
+
 #   When in doubt, do not run as a daemon. Daemon keeps stack traces from being
 #   printed, and you're left wondering why the dæmon is quitting.
     if args.daemonize:
@@ -206,7 +233,7 @@ def main(argv=None):
                     logging.critical("Exception in setting up pidfile: %s" % (sys.exc_info()[0]))
                     sys.exit(6)
                 try:
-                    dh_dns = dhdns(api_key, api_url, local_hostname, configured_interfaces, args.external_ip, external_url, previous_v4_address, previous_v6_address)
+                    dh_dns = create_updater()
                 except:
                     logging.critical("Exception in creating dh_dns: %s" % (sys.exc_info()[0]))
                 while True:
@@ -224,16 +251,14 @@ def main(argv=None):
         setup_logger(logfile, log_level, args.append_log)
         logging.warn("Starting dhdynupdater...")
         setup_prev_addr_file(prev_addr_file)
-        dh_dns = dhdns(api_key, api_url, local_hostname, configured_interfaces, args.external_ip, external_url, previous_v4_address, previous_v6_address)
+        dh_dns = create_updater()
         dh_dns.update_if_necessary()
-        if str(dh_dns.previous_v4_address) != previous_v4_address or str(dh_dns.previous_v6_address) != previous_v6_address:
-            try:
-                fo = open(prev_addr_file, "w")
-                fo.write(str(dh_dns.previous_v4_address) + "\n")
-                fo.write(str(dh_dns.previous_v6_address) + "\n")
-                fo.close()
-            except:
-                logging.critical("Could not write previous addresses to file: %s" % (logfile))
+        current_addresses = sorted(str(address) for address in dh_dns.prev_addresses)
+        current_prefixes = []
+        if prefix_hosts is not None:
+            current_prefixes = sorted(str(prefix) for prefix in dh_dns.superseded_prefixes)
+        if current_addresses != sorted(previous_addresses) or current_prefixes != sorted(previous_prefixes):
+            write_prev_addr_file(prev_addr_file, current_addresses + current_prefixes)
 
     logging.warn("Closing dhdynupdater...")
     logging.shutdown()
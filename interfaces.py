@@ -31,42 +31,164 @@
 import ipaddress
 import logging
 import netifaces
+import os
+import subprocess
 import sys
 
 """
 This module gets the current IPv4 and/or IPv6 addresses of the network
 interfaces provided.
 
-While we could get the full set of interface information using
-netifaces, for this module, we are only interested in one IPv4 and one
-IPv6 address, each having been provided by the configuration
-
 See [netifaces documentation](https://pypi.python.org/pypi/netifaces)
 
 netifaces provides a somewhat standardized method of getting interface
 information, such as IP addresses.
 
-Technically, interfaces can have multiple IP addresses, but multiple
-addresses is not often the case with home users.
-* This chooses the first address for the interface, which covers the use
-  case of many users who only use one ip address per interface.
+Interfaces can have multiple IP addresses; multi-homed hosts commonly do,
+and IPv6 almost always does.  Every globally-scoped address on each
+configured interface is captured into a snapshot (a frozenset), so that
+changes can be detected by a cheap set difference against the previous
+snapshot.
+* Link-local, loopback, multicast and unspecified addresses are never
+  captured.  Private (RFC 1918 / ULA) addresses are kept, as those are what
+  many users behind a NAT publish.
+* Deprecated and temporary (privacy extension) IPv6 addresses are skipped
+  unless configured otherwise.  netifaces doesn't report these flags on
+  Linux or Windows, so they are read from /proc/net/if_inet6 on Linux, and
+  from `netsh interface ipv6 show addresses` on Windows.
+* When an IPv6 address's flags can't be determined, only the first such
+  address per interface is captured (as older versions did), rather than
+  publishing every privacy address the host rotates through.
 
 Also handles the case where an address family isn't used:
 * Not everybody has IPv6.
 * Maybe a user is behind a NAT on IPv4, and is only updating their IPv6
   address in DNS.
 """
+
+ADDRESS_TEMPORARY = 0x01
+ADDRESS_DEPRECATED = 0x02
+
+# Linux ifa_flags, as shown in /proc/net/if_inet6
+IFA_F_TEMPORARY = 0x01
+IFA_F_DEPRECATED = 0x20
+
+# BSD/macOS report flags through netifaces itself.
+IN6_IFF_DEPRECATED = getattr(netifaces, "IN6_IFF_DEPRECATED", 0)
+IN6_IFF_TEMPORARY = getattr(netifaces, "IN6_IFF_TEMPORARY", 0)
+
+def diff_snapshots(previous, current):
+    """Compare two address snapshots; returns (added, removed) sets"""
+    previous = frozenset(previous)
+    current = frozenset(current)
+    return current - previous, previous - current
+
+def parse_if_inet6(lines):
+    """Map each address in /proc/net/if_inet6 to its ADDRESS_* flags"""
+    flags = {}
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 6:
+            continue
+        try:
+            address = ipaddress.IPv6Address(int(fields[0], 16))
+            ifa_flags = int(fields[4], 16)
+        except ValueError:
+            continue
+        flags[address] = 0
+        if ifa_flags & IFA_F_TEMPORARY:
+            flags[address] |= ADDRESS_TEMPORARY
+        if ifa_flags & IFA_F_DEPRECATED:
+            flags[address] |= ADDRESS_DEPRECATED
+    return flags
+
+def parse_netsh_addresses(lines):
+    """Map each address in `netsh interface ipv6 show addresses` output to
+    its ADDRESS_* flags.  Rows look like:
+    Temporary  Deprecated    6d23h59m   0s  2001:db8::1234"""
+    flags = {}
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 5:
+            continue
+        try:
+            address = ipaddress.IPv6Address(fields[-1].split('%')[0])
+        except ValueError:
+            continue
+        flags[address] = 0
+        if fields[0] == "Temporary":
+            flags[address] |= ADDRESS_TEMPORARY
+        if fields[1] == "Deprecated":
+            flags[address] |= ADDRESS_DEPRECATED
+    return flags
+
+def get_ipv6_flags():
+    """Get the ADDRESS_* flags of every IPv6 address on the host, or None
+    if the platform doesn't let us find out."""
+    try:
+        if os.name == 'nt':
+            output = subprocess.run(
+                ["netsh", "interface", "ipv6", "show", "addresses"],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                universal_newlines=True, timeout=10).stdout
+            flags = parse_netsh_addresses(output.splitlines())
+        else:
+            with open("/proc/net/if_inet6") as if_inet6:
+                flags = parse_if_inet6(if_inet6)
+    except (OSError, subprocess.SubprocessError) as error:
+        logging.debug("Could not read IPv6 address flags: %s" % (error))
+        return None
+    # Localised netsh output won't parse; treat it as unknown.
+    return flags or None
+
 class interfaces():
 
-    def __init__(self,configured_interfaces):
+    def __init__(self, configured_interfaces, include_deprecated=False,
+                 include_temporary=False, first_unknown_only=True):
+        self.include_deprecated = include_deprecated
+        self.include_temporary = include_temporary
+        # Whether to keep just the first IPv6 address with unknown flags.
+        # Only publishing needs this; any address will do to find a prefix.
+        self.first_unknown_only = first_unknown_only
         self.addresses = self.get_if_addresses(configured_interfaces)
 
+    def is_publishable(self, address, flags):
+        """Apply the address policy to a single interface address"""
+        if (address.is_link_local or address.is_loopback
+                or address.is_multicast or address.is_unspecified):
+            return False
+        if flags & ADDRESS_DEPRECATED and not self.include_deprecated:
+            logging.debug("Skipping deprecated address %s" % (address))
+            return False
+        if flags & ADDRESS_TEMPORARY and not self.include_temporary:
+            logging.debug("Skipping temporary address %s" % (address))
+            return False
+        return True
+
+    def get_address_flags(self, address, entry, flag_table):
+        """ADDRESS_* flags for an IPv6 address, or None if unknown"""
+        if flag_table is not None and address in flag_table:
+            return flag_table[address]
+        if "flags" in entry and (IN6_IFF_DEPRECATED or IN6_IFF_TEMPORARY):
+            flags = 0
+            if entry["flags"] & IN6_IFF_DEPRECATED:
+                flags |= ADDRESS_DEPRECATED
+            if entry["flags"] & IN6_IFF_TEMPORARY:
+                flags |= ADDRESS_TEMPORARY
+            return flags
+        return None
+
     def get_if_addresses(self, interfaces):
-        """Get IP addresses from configured interfaces"""
+        """Get a snapshot of all IP addresses on the configured interfaces"""
 
-        addresses = []
+        addresses = set()
+        # Both address families may be configured on the same interface;
+        # only ask netifaces once per interface.
+        interface_cache = {}
+        flag_table = None
+        if "AF_INET6" in interfaces:
+            flag_table = get_ipv6_flags()
         for addr_type in interfaces:
-            address_retrieved = True
             # Netifaces has a lookup for address families. The index
             # number is os-dependent, so we look up the index using the
             # method provided by netifaces.
@@ -74,44 +196,56 @@ class interfaces():
                 address_family = netifaces.AF_INET6
             elif addr_type == "AF_INET":
                 address_family = netifaces.AF_INET
-            interface_addresses = netifaces.ifaddresses(interfaces[addr_type])
+            interface_name = interfaces[addr_type]
             try:
-                if addr_type == "AF_INET6":
-                    # I'm not counting on IPv6 to only have one address;
-                    # mulitple is common as there's always link-local in
-                    # addition to an internet-routable address.
-                    # Make sure we don't get a link-local IPv6 Address.
-                    # These are in the subnet fe80:://10
-                    for address in interface_addresses[address_family]:
-                        address_retrieved = True
-                        if address["addr"].split(':')[0] != "fe80":
-                            new_address = address["addr"]
-                            break
-                        # We haven't found a non-link-local IPv6 Address
-                        address_retrieved = False
-                else:
-                    new_address = interface_addresses[address_family][0]["addr"]
+                if interface_name not in interface_cache:
+                    interface_cache[interface_name] = netifaces.ifaddresses(interface_name)
+                interface_addresses = interface_cache[interface_name][address_family]
             except ValueError as exception:
                 # Interface doesn't have an address we could report.
                 logging.warning("Could not get %s address from interface %s."
-                                % (addr_type, interfaces[addr_type]))
+                                % (addr_type, interface_name))
                 logging.warning("Exception: %s" % (exception))
-                address_retrieved = False
+                continue
             except KeyError as index:
                 # Most likely, there is no IP address for the address family
                 # (ie. no IPv4 or IPv6 address on the interface)
                 if str(index) == str(address_family):
-                    logging.warning("No %s address is assigned to interface %s." 
-                                    % (addr_type, interfaces[addr_type]))
+                    logging.warning("No %s address is assigned to interface %s."
+                                    % (addr_type, interface_name))
                 else:
                     logging.error("Unknown KeyError %s in finding %s address"
                                   % (index, addr_type))
-                address_retrieved = False
-            if address_retrieved:
-                new_address = ipaddress.ip_address(new_address)
-                addresses.append(new_address)
-                logging.debug("The current %s Address on %s is: %s"
-                             % (addr_type, interfaces[addr_type], new_address))
-        return addresses
+                continue
+            unknown_flags_taken = False
+            for entry in interface_addresses:
+                # Link-local IPv6 addresses may carry a zone suffix
+                # (fe80::1%eth0), which ipaddress won't parse.
+                try:
+                    new_address = ipaddress.ip_address(entry["addr"].split('%')[0])
+                except ValueError:
+                    logging.warning("Ignoring unparseable %s address %s on %s"
+                                    % (addr_type, entry["addr"], interface_name))
+                    continue
+                flags = 0
+                if new_address.version == 6:
+                    flags = self.get_address_flags(new_address, entry, flag_table)
+                if not self.is_publishable(new_address, flags or 0):
+                    continue
+                if flags is None and self.first_unknown_only:
+                    # Can't tell a privacy address from a stable one; take
+                    # only the first, as older versions did.
+                    if unknown_flags_taken:
+                        logging.debug("Skipping %s, as its flags are unknown"
+                                      % (new_address))
+                        continue
+                    unknown_flags_taken = True
+                addresses.add(new_address)
+                logging.debug("Current %s Address on %s: %s"
+                             % (addr_type, interface_name, new_address))
+        if not addresses:
+            logging.warning("No publishable addresses found on %s"
+                            % (", ".join(interfaces.values())))
+        return frozenset(addresses)
 
 # vim: ts=4 sw=4 et
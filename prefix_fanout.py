@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2016, Troy Telford
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and documentation are
+# those of the authors and should not be interpreted as representing official
+# policies, either expressed or implied.
+
+"""IPv6 Prefix Delegation Fan-out
+
+When the ISP rotates the delegated IPv6 prefix, every host's AAAA record
+changes at once.  Rather than running one dhdynupdate per host, this
+watches a single prefix source (the global IPv6 addresses on one
+interface) and derives each host's address from the current prefix plus
+the host's configured interface ID.
+
+All hosts are reconciled in one pass: the DNS records are listed once per
+DreamHost account (API key), and only the AAAA records which differ from
+the derived addresses are removed or added.
+"""
+
+import ipaddress
+import logging
+import dhdns
+import interfaces
+
+class prefix_fanout():
+
+    def __init__(self, api_url, hosts, prefix_interface, prefix_length, previous_addresses, superseded_prefixes=(), include_deprecated=False, include_temporary=False):
+        """Initialize the fan-out.  hosts is a list of
+        (api_key, hostname, interface_id) tuples; superseded_prefixes are
+        the prefixes a rotation has already moved away from."""
+        if not 0 < prefix_length <= 128:
+            raise ValueError("Invalid prefix length %s" % (prefix_length))
+        self.prefix_length = prefix_length
+        self.configured_interfaces = {"AF_INET6": prefix_interface}
+        self.interface = interfaces.interfaces(self.configured_interfaces,
+                                               include_deprecated,
+                                               include_temporary,
+                                               first_unknown_only=False)
+
+        # Group the hosts by account, so each account is listed only once
+        # per reconcile.
+        self.accounts = {}
+        for api_key, hostname, interface_id in hosts:
+            interface_id = ipaddress.IPv6Address(interface_id)
+            self.accounts.setdefault(api_key, []).append((hostname, interface_id))
+
+        self.prev_addresses = dhdns.previous_snapshot(previous_addresses)
+        # The prefix last published, recovered from the previous addresses
+        # so a one-shot run can tell old from new during a rotation.
+        self.prefix = None
+        previous_prefixes = set(
+            ipaddress.IPv6Network((address, self.prefix_length), strict=False)
+            for address in self.prev_addresses if address.version == 6)
+        if len(previous_prefixes) == 1:
+            self.prefix = previous_prefixes.pop()
+        # Prefixes we have rotated away from, while they're still on the
+        # interface.  These are never picked again, so an overlap can't
+        # flap between the old and new prefix.
+        self.superseded_prefixes = set(map(ipaddress.IPv6Network, superseded_prefixes))
+
+        self.dreamhost_accessor = dhdns.create_accessor(api_url)
+
+    def get_prefix(self):
+        """Determine the delegated prefix from the prefix interface.  While
+        a rotation is in progress the old prefix may still be present next
+        to the new one: a prefix that appears next to the current one
+        supersedes it, and a superseded prefix is never chosen again while
+        it lingers on the interface."""
+        self.interface.addresses = self.interface.get_if_addresses(self.configured_interfaces)
+        present = set(
+            ipaddress.IPv6Network((address, self.prefix_length), strict=False)
+            for address in self.interface.addresses
+            if address.version == 6 and address.is_global)
+        # Forget superseded prefixes once they've left the interface.
+        self.superseded_prefixes &= present
+        candidates = present - self.superseded_prefixes
+        if len(candidates) > 1 and self.prefix in candidates:
+            candidates.discard(self.prefix)
+        if len(candidates) != 1:
+            logging.error("Could not determine a single delegated prefix from %s"
+                          % (sorted(map(str, self.interface.addresses))))
+            return None
+        prefix = candidates.pop()
+        if self.prefix is not None and self.prefix != prefix and self.prefix in present:
+            logging.info("Prefix %s superseded by %s" % (self.prefix, prefix))
+            self.superseded_prefixes.add(self.prefix)
+        return prefix
+
+    def derive_addresses(self, prefix):
+        """Map (api_key, hostname) to the host's address within prefix"""
+        hostmask = int(prefix.hostmask)
+        network = int(prefix.network_address)
+        derived = {}
+        for api_key, hosts in self.accounts.items():
+            for hostname, interface_id in hosts:
+                address = ipaddress.IPv6Address(network | (int(interface_id) & hostmask))
+                derived[(api_key, hostname)] = address
+                logging.debug("Derived address for %s:  %s" % (hostname, address))
+        return derived
+
+    def update_if_necessary(self):
+        """Main dæmon loop - watches the delegated prefix, and if the derived
+        host addresses change, all hosts are updated in one reconcile."""
+        prefix = self.get_prefix()
+        if prefix is None:
+            return
+        derived = self.derive_addresses(prefix)
+        current_addresses = frozenset(derived.values())
+        added, removed = interfaces.diff_snapshots(self.prev_addresses, current_addresses)
+
+        if added or removed:
+            logging.info("Prefix change detected (%s => %s); updating %d hosts"
+                         % (self.prefix, prefix, len(derived)))
+            self.update_addresses(derived)
+            self.prev_addresses = current_addresses
+        else:
+            logging.info("no prefix change detected")
+        self.prefix = prefix
+
+    def update_addresses(self, derived):
+        """Reconcile every host's AAAA records against one listing per
+        account; only records that differ are removed or added."""
+        for api_key, hosts in self.accounts.items():
+            request_params = {"key":api_key, "cmd":"dns-list_records", "format":"json"}
+            logging.info("Connecting to DreamHost API to obtain current DNS records")
+            dns_records = self.dreamhost_accessor.request_get(request_params)["data"]
+
+            hostnames = set(hostname for hostname, interface_id in hosts)
+            published = dict((hostname, {}) for hostname in hostnames)
+            readonly = set()
+            for entry in dns_records:
+                if entry.get("type") != "AAAA" or entry.get("record") not in hostnames:
+                    continue
+                if entry["editable"] == "1":
+                    published[entry["record"]][ipaddress.ip_address(entry["value"])] = entry
+                else:
+                    readonly.add(entry["record"])
+
+            for hostname in sorted(hostnames):
+                if hostname in readonly:
+                    logging.info("Not operating on %s, as it's read-only" % (hostname))
+                    continue
+                wanted = [derived[(api_key, hostname)]]
+                to_add, to_remove = interfaces.diff_snapshots(published[hostname], wanted)
+                for address in sorted(to_remove):
+                    dhdns.remove_record(self.dreamhost_accessor, api_key,
+                                        published[hostname][address])
+                for address in sorted(to_add):
+                    dhdns.add_record(self.dreamhost_accessor, api_key,
+                                     hostname, address)
+# vim: ts=4 sw=4 et
@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2016, Troy Telford
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and documentation are
+# those of the authors and should not be interpreted as representing official
+# policies, either expressed or implied.
+
+"""Soak harness for the dhdynupdate dæmon loop.
+
+Runs dhdns.update_if_necessary() at an accelerated interval for a large
+number of cycles against a local mock of the DreamHost API, while the
+interface addresses change at random.  The mock API runs in a child
+process, so that only the dæmon's own memory and file descriptors are
+measured.  RSS, tracemalloc allocations, open
+file descriptors and per-cycle latency are sampled as it goes; the run
+fails (exit status 1) if any of them grows past its configured threshold.
+
+The dæmon runs for months at a time, so slow leaks and latency creep are
+what this is meant to catch.  Example:
+
+    python3 soak.py --cycles 200000 --sample-every 5000
+"""
+
+import argparse
+import http.server
+import ipaddress
+import json
+import logging
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.parse
+import requests
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+import interfaces
+from dhdns import dhdns
+
+HOSTNAME = "soak.example.com"
+SOAK_INTERFACE = "soak0"
+# Documentation ranges only; nothing here is ever routable.
+V4_NETWORK = ipaddress.ip_network("192.0.2.0/24")
+V6_NETWORK = ipaddress.ip_network("2001:db8::/64")
+
+class mock_api(http.server.ThreadingHTTPServer):
+    """Just enough of the DreamHost DNS API for dhdns"""
+    daemon_threads = True
+
+    def __init__(self, calls):
+        super().__init__(("127.0.0.1", 0), mock_api_handler)
+        self.records = {}
+        self.lock = threading.Lock()
+        # Shared with the harness process
+        self.calls = calls
+
+    def handle_command(self, params):
+        with self.lock:
+            self.calls.value += 1
+            cmd = params.get("cmd")
+            if cmd == "dns-list_records":
+                data = [{"record": record, "type": record_type,
+                         "value": value, "editable": "1"}
+                        for (record, record_type, value) in self.records]
+                return {"result": "success", "data": data}
+            key = (params.get("record"), params.get("type"), params.get("value"))
+            if cmd == "dns-add_record" and key not in self.records:
+                self.records[key] = params.get("comment", "")
+                return {"result": "success", "data": "record_added"}
+            if cmd == "dns-remove_record" and key in self.records:
+                del self.records[key]
+                return {"result": "success", "data": "record_removed"}
+            return {"result": "error", "data": "invalid_command"}
+
+class mock_api_handler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        query = urllib.parse.urlsplit(self.path).query
+        params = dict(urllib.parse.parse_qsl(query))
+        body = json.dumps(self.server.handle_command(params)).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve_mock_api(port_queue, calls):
+    """Child process: run the mock API until terminated"""
+    server = mock_api(calls)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+class address_churn():
+    """Fake interface whose addresses change at random between cycles"""
+
+    def __init__(self, change_rate, max_per_family, seed):
+        self.change_rate = change_rate
+        self.max_per_family = max_per_family
+        self.random = random.Random(seed)
+        self.v4 = [self.random_address(V4_NETWORK)]
+        self.v6 = [self.random_address(V6_NETWORK)]
+
+    def random_address(self, network):
+        offset = self.random.randrange(1, min(network.num_addresses - 1, 2**32))
+        return str(network[offset])
+
+    def churn(self):
+        """Maybe add, remove or replace one address in a random family"""
+        if self.random.random() >= self.change_rate:
+            return
+        if self.random.random() < 0.5:
+            pool, network = self.v4, V4_NETWORK
+        else:
+            pool, network = self.v6, V6_NETWORK
+        action = self.random.choice(("add", "remove", "replace"))
+        if action == "add" and len(pool) < self.max_per_family:
+            pool.append(self.random_address(network))
+        elif action == "remove" and len(pool) > 1:
+            pool.pop(self.random.randrange(len(pool)))
+        else:
+            pool[self.random.randrange(len(pool))] = self.random_address(network)
+
+    def ipv6_flags(self):
+        """Every fake IPv6 address is stable and preferred"""
+        return dict((ipaddress.IPv6Address(a), 0) for a in self.v6)
+
+    def ifaddresses(self, interface_name):
+        return {interfaces.netifaces.AF_INET: [{"addr": a} for a in self.v4],
+                interfaces.netifaces.AF_INET6:
+                    [{"addr": "fe80::1%" + interface_name}]
+                    + [{"addr": a} for a in self.v6]}
+
+def rss_bytes():
+    """Current resident set size, or None if it can't be determined"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def open_fds():
+    """Number of open file descriptors (handles on Windows), or None"""
+    if psutil is not None:
+        process = psutil.Process()
+        if os.name == 'nt':
+            return process.num_handles()
+        return process.num_fds()
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return None
+
+class soak():
+
+    def __init__(self, args):
+        self.args = args
+        self.samples = []
+        # Per-cycle latencies since the last sample, kept apart for cycles
+        # which reconciled with the API and those which found no change.
+        self.latencies = {"idle": [], "update": []}
+        self.baseline_snapshot = None
+        self.failures = []
+
+    def sample(self, cycle):
+        latency = {}
+        for path, window in self.latencies.items():
+            latency[path] = statistics.median(window) if window else None
+            del window[:]
+        sample = {"cycle": cycle,
+                  "rss": rss_bytes(),
+                  "fds": open_fds(),
+                  "traced": None,
+                  "latency": latency}
+        if tracemalloc.is_tracing():
+            sample["traced"] = tracemalloc.get_traced_memory()[0]
+        self.samples.append(sample)
+        logging.warning("cycle %d: rss=%s fds=%s traced=%s median latency idle=%.3fms update=%.3fms"
+                        % (cycle, sample["rss"], sample["fds"], sample["traced"],
+                           (latency["idle"] or 0) * 1000,
+                           (latency["update"] or 0) * 1000))
+        # Read after the traced total, so the comparison snapshot isn't
+        # counted in it.
+        sample["top"] = [str(stat) for stat in self.top_allocators()]
+        for stat in sample["top"]:
+            logging.warning("cycle %d: top allocator: %s" % (cycle, stat))
+        return sample
+
+    def take_snapshot(self):
+        """tracemalloc snapshot of the dæmon, without the harness itself"""
+        return tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__),
+             tracemalloc.Filter(False, __file__)))
+
+    def top_allocators(self):
+        """Allocation sites which grew the most since the baseline"""
+        if self.baseline_snapshot is None or not self.samples[:-1]:
+            return []
+        snapshot = self.take_snapshot()
+        stats = snapshot.compare_to(self.baseline_snapshot, "lineno")
+        return stats[:self.args.top]
+
+    def check(self, baseline, final):
+        """Compare the final sample against the post-warmup baseline"""
+        def growth(key):
+            if baseline[key] is None or final[key] is None:
+                return None
+            return final[key] - baseline[key]
+
+        rss_growth = growth("rss")
+        if rss_growth is not None and rss_growth > self.args.max_rss_growth * 2**20:
+            self.failures.append("RSS grew by %.1f MiB (limit %s MiB)"
+                                 % (rss_growth / 2**20, self.args.max_rss_growth))
+        traced_growth = growth("traced")
+        if traced_growth is not None and traced_growth > self.args.max_traced_growth * 2**20:
+            self.failures.append("Traced memory grew by %.1f MiB (limit %s MiB)"
+                                 % (traced_growth / 2**20, self.args.max_traced_growth))
+        fd_growth = growth("fds")
+        if fd_growth is not None and fd_growth > self.args.max_fd_growth:
+            self.failures.append("Open file descriptors grew by %d (limit %d)"
+                                 % (fd_growth, self.args.max_fd_growth))
+        for path in ("idle", "update"):
+            self.check_latency(baseline, path)
+
+    def check_latency(self, baseline, path):
+        """Compare the window medians of the first third of the run (after
+        warmup) against those of the last third.  Taking the median of
+        several windows keeps one slow window from failing the run."""
+        medians = [sample["latency"][path] for sample in self.samples
+                   if sample["cycle"] > baseline["cycle"]
+                   and sample["latency"][path] is not None]
+        if len(medians) < 3:
+            logging.warning("Only %d %s latency windows; not checking drift"
+                            % (len(medians), path))
+            return
+        third = len(medians) // 3
+        early = statistics.median(medians[:third])
+        late = statistics.median(medians[-third:])
+        drift = late / early
+        logging.warning("Median %s cycle latency %.3fms => %.3fms (%.2fx)"
+                        % (path, early * 1000, late * 1000, drift))
+        if drift > self.args.max_latency_drift:
+            self.failures.append("Median %s cycle latency drifted %.2fx (limit %.2fx)"
+                                 % (path, drift, self.args.max_latency_drift))
+
+    def run(self):
+        args = self.args
+        port_queue = multiprocessing.Queue()
+        calls = multiprocessing.Value("L", 0)
+        server = multiprocessing.Process(target=serve_mock_api,
+                                         args=(port_queue, calls), daemon=True)
+        server.start()
+        api_url = "http://127.0.0.1:%d/" % (port_queue.get(timeout=30))
+
+        churn = address_churn(args.change_rate, args.max_per_family, args.seed)
+        interfaces.netifaces.ifaddresses = churn.ifaddresses
+        interfaces.get_ipv6_flags = churn.ipv6_flags
+        configured_interfaces = {"AF_INET": SOAK_INTERFACE,
+                                 "AF_INET6": SOAK_INTERFACE}
+
+        if args.tracemalloc:
+            tracemalloc.start()
+        dh_dns = dhdns("SOAKTEST", api_url, HOSTNAME, configured_interfaces,
+                       False, None, [])
+
+        baseline = None
+        for cycle in range(1, args.cycles + 1):
+            churn.churn()
+            # A new snapshot is only kept after reconciling with the API.
+            previous = dh_dns.prev_addresses
+            start = time.perf_counter()
+            dh_dns.update_if_necessary()
+            elapsed = time.perf_counter() - start
+            if dh_dns.prev_addresses is previous:
+                self.latencies["idle"].append(elapsed)
+            else:
+                self.latencies["update"].append(elapsed)
+            if args.interval:
+                time.sleep(args.interval)
+
+            if cycle == args.warmup:
+                # Take the snapshot first, so the memory it holds is part
+                # of the baseline rather than counted as growth.
+                if tracemalloc.is_tracing():
+                    self.baseline_snapshot = self.take_snapshot()
+                baseline = self.sample(cycle)
+            elif cycle % args.sample_every == 0:
+                self.sample(cycle)
+
+        if self.samples[-1]["cycle"] == args.cycles:
+            final = self.samples[-1]
+        else:
+            final = self.sample(args.cycles)
+        published = requests.get(api_url, params={"cmd": "dns-list_records"}).json()["data"]
+        server.terminate()
+        server.join()
+
+        if baseline is None:
+            logging.critical("Warmup (%d cycles) never completed; nothing to compare"
+                             % (args.warmup))
+            return 2
+        self.check(baseline, final)
+        logging.warning("%d API calls; %d records published at the end"
+                        % (calls.value, len(published)))
+        for failure in self.failures:
+            logging.critical(failure)
+        if self.failures:
+            return 1
+        logging.warning("Soak passed")
+        return 0
+
+def main(argv=None):
+    """Command line parser for the soak harness"""
+    cmd_parser = argparse.ArgumentParser(description="Soak test the dhdynupdate dæmon loop")
+    cmd_parser.add_argument("--cycles", action='store', type=int,
+                            default=200000, dest="cycles",
+                            help="Number of dæmon loop cycles to run")
+    cmd_parser.add_argument("--interval", action='store', type=float,
+                            default=0.0, dest="interval",
+                            help="Seconds to sleep between cycles")
+    cmd_parser.add_argument("--warmup", action='store', type=int,
+                            default=1000, dest="warmup",
+                            help="Cycles to run before taking the baseline sample")
+    cmd_parser.add_argument("--sample-every", action='store', type=int,
+                            default=5000, dest="sample_every",
+                            help="Cycles between samples")
+    cmd_parser.add_argument("--change-rate", action='store', type=float,
+                            default=0.05, dest="change_rate",
+                            help="Probability of an address change each cycle")
+    cmd_parser.add_argument("--max-per-family", action='store', type=int,
+                            default=4, dest="max_per_family",
+                            help="Most addresses per family on the fake interface")
+    cmd_parser.add_argument("--seed", action='store', type=int,
+                            default=None, dest="seed",
+                            help="Random seed, for reproducing a run")
+    cmd_parser.add_argument("--no-tracemalloc", action='store_false',
+                            default=True, dest="tracemalloc",
+                            help="Don't trace allocations (faster)")
+    cmd_parser.add_argument("--top", action='store', type=int,
+                            default=10, dest="top",
+                            help="Number of top allocators to report")
+    cmd_parser.add_argument("--max-rss-growth", action='store', type=float,
+                            default=16, dest="max_rss_growth", metavar="MiB",
+                            help="Allowed RSS growth after warmup")
+    cmd_parser.add_argument("--max-traced-growth", action='store', type=float,
+                            default=4, dest="max_traced_growth", metavar="MiB",
+                            help="Allowed tracemalloc growth after warmup")
+    cmd_parser.add_argument("--max-fd-growth", action='store', type=int,
+                            default=4, dest="max_fd_growth",
+                            help="Allowed open file descriptor growth after warmup")
+    cmd_parser.add_argument("--max-latency-drift", action='store', type=float,
+                            default=2.0, dest="max_latency_drift", metavar="ratio",
+                            help="Allowed ratio of late to early median latency, for both idle and update cycles")
+    cmd_parser.add_argument("--debug", action='store', type=str,
+                            default="INFO", dest="log_level", metavar="lvl",
+                            help="Log level for the dæmon's own messages (default INFO, as the dæmon normally runs)")
+    args = cmd_parser.parse_args(argv)
+
+    if args.cycles < args.warmup or args.warmup < 1 or args.sample_every < 1:
+        cmd_parser.error("--cycles must be at least --warmup, and both positive")
+
+    # The dæmon's messages still get formatted and written -- that's part of
+    # what is being soaked -- but to the null device, so the harness's own
+    # report stays readable on the console.
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                        level=logging.WARNING)
+    daemon_log = logging.FileHandler(os.devnull)
+    daemon_log.setFormatter(logging.Formatter('%(asctime)s %(levelname)s: %(message)s'))
+    logging.getLogger().addHandler(daemon_log)
+    logging.getLogger().setLevel(args.log_level)
+    logging.getLogger().handlers[0].setLevel(logging.WARNING)
+    logging.getLogger("urllib3").setLevel(logging.WARNING)
+
+    return soak(args).run()
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# vim: ts=4 sw=4 et
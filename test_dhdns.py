@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2016, Troy Telford
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and documentation are
+# those of the authors and should not be interpreted as representing official
+# policies, either expressed or implied.
+
+"""Tests for DreamHost record reconciliation"""
+
+import ipaddress
+import unittest
+from unittest import mock
+
+import dhdns
+import interfaces
+
+AF_INET = interfaces.netifaces.AF_INET
+AF_INET6 = interfaces.netifaces.AF_INET6
+
+class fake_accessor():
+    """Records API calls, and answers them from a fixed record list"""
+
+    def __init__(self, records):
+        self.records = records
+        self.calls = []
+
+    def request_get(self, request_params):
+        self.calls.append((request_params["cmd"], request_params.get("value")))
+        return {"result": "success", "data": self.records}
+
+def record(record_type, value, editable="1"):
+    return {"record": "host.example.com", "type": record_type,
+            "value": value, "editable": editable}
+
+class test_dhdns(unittest.TestCase):
+
+    def make_dhdns(self, ifaddresses, records, configured_interfaces=None,
+                   external_ip=None):
+        if configured_interfaces is None:
+            configured_interfaces = {"AF_INET": "eth0", "AF_INET6": "eth0"}
+        # Every IPv6 address is a stable, preferred one.
+        flag_table = dict((ipaddress.ip_address(entry["addr"]), 0)
+                          for entry in ifaddresses.get(AF_INET6, []))
+        for patcher in (mock.patch.object(interfaces.netifaces, "ifaddresses",
+                                          return_value=ifaddresses),
+                        mock.patch("interfaces.get_ipv6_flags",
+                                   return_value=flag_table)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        accessor = fake_accessor(records)
+        with mock.patch("dhdns.create_accessor", return_value=accessor):
+            dh_dns = dhdns.dhdns("KEY", "http://localhost/", "host.example.com",
+                                 configured_interfaces, False, None, [])
+        if external_ip is not None:
+            dh_dns.use_external = True
+            dh_dns.external_ip = ipaddress.ip_address(external_ip)
+        return dh_dns, accessor
+
+    def test_only_delta_is_sent(self):
+        dh_dns, accessor = self.make_dhdns(
+            {AF_INET: [{"addr": "198.51.100.1"}, {"addr": "198.51.100.2"}],
+             AF_INET6: [{"addr": "2600::1"}, {"addr": "2600::2"}]},
+            [record("A", "198.51.100.1"), record("A", "198.51.100.3"),
+             record("AAAA", "2600::1"), record("AAAA", "2600::3"),
+             record("TXT", "not an address")])
+        dh_dns.update_if_necessary()
+        self.assertEqual(sorted(accessor.calls), sorted([
+            ("dns-list_records", None),
+            ("dns-remove_record", "198.51.100.3"),
+            ("dns-remove_record", "2600::3"),
+            ("dns-add_record", "198.51.100.2"),
+            ("dns-add_record", "2600::2")]))
+
+        # Nothing changed; no API calls at all.
+        accessor.calls = []
+        dh_dns.update_if_necessary()
+        self.assertEqual(accessor.calls, [])
+
+    def test_readonly_family_left_alone(self):
+        dh_dns, accessor = self.make_dhdns(
+            {AF_INET: [{"addr": "198.51.100.1"}],
+             AF_INET6: [{"addr": "2600::1"}]},
+            [record("AAAA", "2600::9", editable="0")])
+        dh_dns.update_if_necessary()
+        self.assertEqual(accessor.calls, [("dns-list_records", None),
+                                          ("dns-add_record", "198.51.100.1")])
+
+    def test_unmanaged_family_untouched(self):
+        dh_dns, accessor = self.make_dhdns(
+            {AF_INET: [{"addr": "198.51.100.1"}]},
+            [record("AAAA", "2600::9")],
+            configured_interfaces={"AF_INET": "eth0"})
+        dh_dns.update_if_necessary()
+        self.assertEqual(accessor.calls, [("dns-list_records", None),
+                                          ("dns-add_record", "198.51.100.1")])
+
+    def test_external_ip_replaces_local_ipv4(self):
+        dh_dns, accessor = self.make_dhdns(
+            {AF_INET: [{"addr": "192.168.1.5"}, {"addr": "10.0.0.5"}],
+             AF_INET6: [{"addr": "2600::1"}]},
+            [], external_ip="198.51.100.9")
+        dh_dns.update_if_necessary()
+        self.assertEqual(sorted(accessor.calls), sorted([
+            ("dns-list_records", None),
+            ("dns-add_record", "198.51.100.9"),
+            ("dns-add_record", "2600::1")]))
+
+    def test_external_ip_needs_local_ipv4(self):
+        dh_dns, accessor = self.make_dhdns(
+            {AF_INET6: [{"addr": "2600::1"}]},
+            [], configured_interfaces={"AF_INET6": "eth0"},
+            external_ip="198.51.100.9")
+        dh_dns.update_if_necessary()
+        self.assertEqual(accessor.calls, [("dns-list_records", None),
+                                          ("dns-add_record", "2600::1")])
+
+if __name__ == "__main__":
+    unittest.main()
+
+# vim: ts=4 sw=4 et
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2016, Troy Telford
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and documentation are
+# those of the authors and should not be interpreted as representing official
+# policies, either expressed or implied.
+
+"""Tests for the previous address file"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import dhdns
+import dhdynupdate
+
+class test_prev_addr_file(unittest.TestCase):
+
+    def load(self, contents):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "prev_addr.txt")
+        with open(path, "w") as fo:
+            fo.write(contents)
+        with mock.patch.object(dhdynupdate, "previous_addresses", []), \
+             mock.patch.object(dhdynupdate, "previous_prefixes", []):
+            dhdynupdate.setup_prev_addr_file(path)
+            self.previous_prefixes = list(dhdynupdate.previous_prefixes)
+            return list(dhdynupdate.previous_addresses)
+
+    def test_legacy_file_is_empty_snapshot(self):
+        previous_addresses = self.load("127.0.0.1\n::1\n")
+        self.assertEqual(dhdns.previous_snapshot(previous_addresses), frozenset())
+
+    def test_one_address_per_line(self):
+        previous_addresses = self.load("198.51.100.1\n2600:0::1\n\nnonsense\n")
+        self.assertEqual(previous_addresses, ["198.51.100.1", "2600::1"])
+
+    def test_superseded_prefixes(self):
+        previous_addresses = self.load("2600:db8:2::a6\n2600:db8:1::/56\n")
+        self.assertEqual(previous_addresses, ["2600:db8:2::a6"])
+        self.assertEqual(self.previous_prefixes, ["2600:db8:1::/56"])
+
+if __name__ == "__main__":
+    unittest.main()
+
+# vim: ts=4 sw=4 et
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2016, Troy Telford
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and documentation are
+# those of the authors and should not be interpreted as representing official
+# policies, either expressed or implied.
+
+"""Tests for interface address snapshots"""
+
+import ipaddress
+import unittest
+from unittest import mock
+
+import interfaces
+
+AF_INET = interfaces.netifaces.AF_INET
+AF_INET6 = interfaces.netifaces.AF_INET6
+
+def ip(address):
+    return ipaddress.ip_address(address)
+
+class test_interfaces(unittest.TestCase):
+
+    def get_addresses(self, ifaddresses, flag_table=None, **policy):
+        with mock.patch.object(interfaces.netifaces, "ifaddresses",
+                               return_value=ifaddresses), \
+             mock.patch("interfaces.get_ipv6_flags", return_value=flag_table):
+            return interfaces.interfaces({"AF_INET": "eth0", "AF_INET6": "eth0"},
+                                         **policy).addresses
+
+    def test_link_local_and_loopback_filtered(self):
+        addresses = self.get_addresses(
+            {AF_INET: [{"addr": "127.0.0.1"}, {"addr": "169.254.1.1"},
+                       {"addr": "192.168.1.5"}],
+             AF_INET6: [{"addr": "fe80::1%eth0"}, {"addr": "::1"},
+                        {"addr": "2600::5"}]},
+            {ip("2600::5"): 0})
+        self.assertEqual(addresses, frozenset([ip("192.168.1.5"), ip("2600::5")]))
+
+    def test_all_addresses_captured(self):
+        addresses = self.get_addresses(
+            {AF_INET: [{"addr": "192.168.1.5"}, {"addr": "10.0.0.5"}],
+             AF_INET6: [{"addr": "2600::5"}, {"addr": "2600::6"}]},
+            {ip("2600::5"): 0, ip("2600::6"): 0})
+        self.assertEqual(len(addresses), 4)
+
+    def test_temporary_and_deprecated_filtered(self):
+        ifaddresses = {AF_INET6: [{"addr": "2600::5"}, {"addr": "2600::7e"},
+                                  {"addr": "2600::de"}]}
+        flag_table = {ip("2600::5"): 0,
+                      ip("2600::7e"): interfaces.ADDRESS_TEMPORARY,
+                      ip("2600::de"): interfaces.ADDRESS_DEPRECATED}
+        self.assertEqual(self.get_addresses(ifaddresses, flag_table),
+                         frozenset([ip("2600::5")]))
+        self.assertEqual(self.get_addresses(ifaddresses, flag_table,
+                                            include_temporary=True,
+                                            include_deprecated=True),
+                         frozenset(flag_table))
+
+    def test_unknown_flags_takes_first_address(self):
+        ifaddresses = {AF_INET6: [{"addr": "2600::5"}, {"addr": "2600::6"}]}
+        self.assertEqual(self.get_addresses(ifaddresses, None),
+                         frozenset([ip("2600::5")]))
+        self.assertEqual(self.get_addresses(ifaddresses, None,
+                                            first_unknown_only=False),
+                         frozenset([ip("2600::5"), ip("2600::6")]))
+
+    def test_parse_if_inet6(self):
+        flags = interfaces.parse_if_inet6([
+            "26000000000000000000000000000005 02 40 00 00     eth0",
+            "2600000000000000000000000000007e 02 40 00 01     eth0",
+            "260000000000000000000000000000de 02 40 00 20     eth0"])
+        self.assertEqual(flags, {ip("2600::5"): 0,
+                                 ip("2600::7e"): interfaces.ADDRESS_TEMPORARY,
+                                 ip("2600::de"): interfaces.ADDRESS_DEPRECATED})
+
+    def test_parse_netsh_addresses(self):
+        flags = interfaces.parse_netsh_addresses([
+            "Interface 12: Ethernet",
+            "",
+            "Addr Type  DAD State   Valid Life Pref. Life Address",
+            "---------  ----------- ---------- ---------- ------------------------",
+            "Public     Preferred    1d23h59m   3h59m58s 2600::5",
+            "Temporary  Deprecated   6d23h59m         0s 2600::7e",
+            "Other      Preferred    infinite   infinite fe80::1%12"])
+        self.assertEqual(flags, {
+            ip("2600::5"): 0,
+            ip("2600::7e"): interfaces.ADDRESS_TEMPORARY | interfaces.ADDRESS_DEPRECATED,
+            ip("fe80::1"): 0})
+
+    def test_diff_snapshots(self):
+        added, removed = interfaces.diff_snapshots(
+            [ip("192.0.2.1"), ip("192.0.2.2")], [ip("192.0.2.2"), ip("192.0.2.3")])
+        self.assertEqual(added, frozenset([ip("192.0.2.3")]))
+        self.assertEqual(removed, frozenset([ip("192.0.2.1")]))
+
+if __name__ == "__main__":
+    unittest.main()
+
+# vim: ts=4 sw=4 et
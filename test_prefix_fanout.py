@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2016, Troy Telford
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and documentation are
+# those of the authors and should not be interpreted as representing official
+# policies, either expressed or implied.
+
+"""Tests for the IPv6 prefix delegation fan-out"""
+
+import unittest
+from unittest import mock
+
+import interfaces
+import prefix_fanout
+
+OLD_PREFIX_ADDRESS = "2600:db8:1::5"
+NEW_PREFIX_ADDRESS = "2600:db8:2::5"
+
+class fake_accessor():
+    """Records API calls, and answers them from a fixed record list"""
+
+    def __init__(self, records):
+        self.records = records
+        self.calls = []
+
+    def request_get(self, request_params):
+        self.calls.append((request_params["key"], request_params["cmd"],
+                           request_params.get("record"),
+                           request_params.get("value")))
+        return {"result": "success", "data": self.records}
+
+def record(hostname, value, editable="1"):
+    return {"record": hostname, "type": "AAAA", "value": value,
+            "editable": editable}
+
+class test_prefix_fanout(unittest.TestCase):
+
+    def setUp(self):
+        self.interface_addresses = []
+        patcher = mock.patch.object(interfaces.netifaces, "ifaddresses",
+                                    side_effect=self.ifaddresses)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Like Windows: no address flags, so nothing marks the old prefix
+        # as deprecated.
+        patcher = mock.patch("interfaces.get_ipv6_flags", return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def ifaddresses(self, interface_name):
+        return {interfaces.netifaces.AF_INET6:
+                [{"addr": address} for address in self.interface_addresses]}
+
+    def make_fanout(self, records, previous_addresses, superseded_prefixes=(),
+                    hosts=(("KEY", "host.example.com", "::a6"),)):
+        accessor = fake_accessor(records)
+        with mock.patch("dhdns.create_accessor", return_value=accessor):
+            fanout = prefix_fanout.prefix_fanout(
+                "http://localhost/", list(hosts), "eth0", 56,
+                previous_addresses, superseded_prefixes)
+        return fanout, accessor
+
+    def test_rotation_overlap_in_fresh_process(self):
+        # Old and new prefixes are both on the interface, and this is a
+        # new process: the previous address file says which one is old.
+        self.interface_addresses = [OLD_PREFIX_ADDRESS, NEW_PREFIX_ADDRESS]
+        fanout, accessor = self.make_fanout(
+            [record("host.example.com", "2600:db8:1::a6")], ["2600:db8:1::a6"])
+        fanout.update_if_necessary()
+        self.assertEqual(accessor.calls, [
+            ("KEY", "dns-list_records", None, None),
+            ("KEY", "dns-remove_record", "host.example.com", "2600:db8:1::a6"),
+            ("KEY", "dns-add_record", "host.example.com", "2600:db8:2::a6")])
+
+    def test_rotation_overlap_does_not_flap(self):
+        self.interface_addresses = [OLD_PREFIX_ADDRESS, NEW_PREFIX_ADDRESS]
+        fanout, accessor = self.make_fanout(
+            [record("host.example.com", "2600:db8:1::a6")], ["2600:db8:1::a6"])
+        fanout.update_if_necessary()
+        self.assertEqual(len(accessor.calls), 3)
+
+        for cycle in range(3):
+            accessor.calls = []
+            fanout.update_if_necessary()
+            self.assertEqual(accessor.calls, [])
+            self.assertEqual(str(fanout.prefix), "2600:db8:2::/56")
+
+        # The old prefix finally leaves the interface.
+        self.interface_addresses = [NEW_PREFIX_ADDRESS]
+        fanout.update_if_necessary()
+        self.assertEqual(accessor.calls, [])
+        self.assertEqual(fanout.superseded_prefixes, set())
+
+    def test_rotation_overlap_across_one_shot_runs(self):
+        # Each run is a new process, seeded from what the last one saved.
+        self.interface_addresses = [OLD_PREFIX_ADDRESS, NEW_PREFIX_ADDRESS]
+        fanout, accessor = self.make_fanout([], ["2600:db8:1::a6"])
+        fanout.update_if_necessary()
+        self.assertEqual(accessor.calls[-1][3], "2600:db8:2::a6")
+
+        for run in range(3):
+            saved_addresses = [str(address) for address in fanout.prev_addresses]
+            saved_prefixes = [str(prefix) for prefix in fanout.superseded_prefixes]
+            self.assertEqual(saved_prefixes, ["2600:db8:1::/56"])
+            fanout, accessor = self.make_fanout([], saved_addresses, saved_prefixes)
+            fanout.update_if_necessary()
+            self.assertEqual(accessor.calls, [])
+
+    def test_unchanged_prefix_makes_no_calls(self):
+        self.interface_addresses = [OLD_PREFIX_ADDRESS]
+        fanout, accessor = self.make_fanout([], ["2600:db8:1::a6"])
+        fanout.update_if_necessary()
+        self.assertEqual(accessor.calls, [])
+
+    def test_one_listing_per_account(self):
+        self.interface_addresses = [NEW_PREFIX_ADDRESS]
+        records = [record("a.example.com", "2600:db8:1::a"),
+                   record("b.example.com", "2600:db8:2::b"),
+                   record("c.example.com", "2600:db8:1::c", editable="0"),
+                   record("d.example.com", "2600:db8:1::d")]
+        hosts = [("KEY1", "a.example.com", "::a"),
+                 ("KEY1", "b.example.com", "::b"),
+                 ("KEY2", "c.example.com", "::c"),
+                 ("KEY2", "d.example.com", "::d")]
+        fanout, accessor = self.make_fanout(records, [], hosts=hosts)
+        fanout.update_if_necessary()
+
+        list_calls = [call for call in accessor.calls
+                      if call[1] == "dns-list_records"]
+        self.assertEqual(sorted(call[0] for call in list_calls), ["KEY1", "KEY2"])
+        changes = [call for call in accessor.calls
+                   if call[1] != "dns-list_records"]
+        self.assertEqual(sorted(changes), sorted([
+            ("KEY1", "dns-remove_record", "a.example.com", "2600:db8:1::a"),
+            ("KEY1", "dns-add_record", "a.example.com", "2600:db8:2::a"),
+            ("KEY2", "dns-remove_record", "d.example.com", "2600:db8:1::d"),
+            ("KEY2", "dns-add_record", "d.example.com", "2600:db8:2::d")]))
+
+        # Steady state: nothing more to do.
+        accessor.calls = []
+        fanout.update_if_necessary()
+        self.assertEqual(accessor.calls, [])
+
+if __name__ == "__main__":
+    unittest.main()
+
+# vim: ts=4 sw=4 et